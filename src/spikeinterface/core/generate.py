@@ -1,4 +1,5 @@
 import math
+import sys
 import warnings
 import numpy as np
 from typing import Union, Optional, List, Literal
@@ -358,16 +359,9 @@ def synthesize_random_firings(
 
     """
 
+    # one generator for all units: no per unit seeding or RandomState construction
     rng = np.random.default_rng(seed=seed)
 
-    # unit_seeds = [rng.integers(0, 2 ** 63) for i in range(num_units)]
-
-    # if seed is not None:
-    #     np.random.seed(seed)
-    #     seeds = np.random.RandomState(seed=seed).randint(0, 2147483647, num_units)
-    # else:
-    #     seeds = np.random.randint(0, 2147483647, num_units)
-
     if np.isscalar(firing_rates):
         firing_rates = np.full(num_units, firing_rates, dtype="float64")
 
@@ -375,38 +369,42 @@ def synthesize_random_firings(
 
     segment_size = int(sampling_frequency * duration)
 
-    times = []
-    labels = []
+    num_spikes = (np.asarray(firing_rates) * duration).astype("int64")
+    # we take a bit more spikes and then remove if too much of then
+    num_draws = (num_spikes + 10 * np.sqrt(num_spikes)).astype("int64")
+    # one draw for all units, each unit get its own slice
+    all_spike_times = rng.integers(0, segment_size, np.sum(num_draws))
+    unit_ptr = np.concatenate([[0], np.cumsum(num_draws)])
+
+    # each unit keeps at most num_spikes[unit_ind] spikes so the output can be allocated once
+    times = np.empty(np.sum(num_spikes), dtype="int64")
+    labels = np.empty(np.sum(num_spikes), dtype="int64")
+    offset = 0
     for unit_ind in range(num_units):
-        n_spikes = int(firing_rates[unit_ind] * duration)
-        # we take a bit more spikes and then remove if too much of then
-        n = int(n_spikes + 10 * np.sqrt(n_spikes))
-        spike_times = rng.integers(0, segment_size, n)
-        spike_times = np.sort(spike_times)
+        n_spikes = num_spikes[unit_ind]
+        spike_times = all_spike_times[unit_ptr[unit_ind] : unit_ptr[unit_ind + 1]]
 
         # make less flat autocorrelogram shape by jittering half of the spikes
         if add_shift_shuffle:
-            # this replace the previous rand_distr2()
+            # this replace the previous rand_distr2() : draws come from the same rng, no reseeding per unit
             some = rng.choice(spike_times.size, spike_times.size // 2, replace=False)
             x = rng.random(some.size)
             a = refractory_sample
             b = refractory_sample * 20
             shift = a + (b - a) * x**2
-            spike_times[some] += shift
-            times0 = times0[(0 <= times0) & (times0 < segment_size)]
+            spike_times[some] += shift.astype(spike_times.dtype)
+            spike_times = spike_times[(0 <= spike_times) & (spike_times < segment_size)]
 
-        (violations,) = np.nonzero(np.diff(spike_times) < refractory_sample)
-        spike_times = np.delete(spike_times, violations)
+        spike_times = clean_refractory_period(spike_times, refractory_sample)
         if len(spike_times) > n_spikes:
             spike_times = rng.choice(spike_times, n_spikes, replace=False)
 
-        spike_labels = np.ones(spike_times.size, dtype="int64") * unit_ind
-
-        times.append(spike_times.astype("int64"))
-        labels.append(spike_labels)
+        times[offset : offset + spike_times.size] = spike_times
+        labels[offset : offset + spike_times.size] = unit_ind
+        offset += spike_times.size
 
-    times = np.concatenate(times)
-    labels = np.concatenate(labels)
+    times = times[:offset]
+    labels = labels[:offset]
 
     sort_inds = np.argsort(times)
     times = times[sort_inds]
@@ -419,6 +417,10 @@ def clean_refractory_period(times, refractory_period):
     """
     Remove spike that violate the refractory period in a given spike train.
 
+    This is a greedy approach: a spike is kept only if it is strictly more than refractory_period
+    after the last kept spike. The numba compiled loop is used only when numba is already imported or for
+    very long spike trains, because loading numba costs more than the numpy version in other cases.
+
     times and refractory_period must have the same units : samples or second or ms
     """
 
@@ -426,16 +428,85 @@ def clean_refractory_period(times, refractory_period):
         return times
 
     times = np.sort(times)
+    if "numba" in sys.modules or times.size > 5_000_000:
+        clean_func = get_optimized_clean_refractory_period()
+    else:
+        clean_func = None
+    if clean_func is None:
+        return _clean_refractory_period_numpy(times, refractory_period)
+
+    out = np.empty_like(times)
+    num_kept = clean_func(times, refractory_period, out)
+
+    return out[:num_kept]
+
+
+def _clean_refractory_period_numpy(times_sorted, refractory_period):
+    # a spike more than refractory_period after its predecessor starts a run and is always kept by the greedy approach
+    # inside a run, the spike kept after the spike i is the first one more than refractory_period after it: next_kept[i]
+    # kept spikes are followed from the run starts with pointer doubling (next_kept is squared at each pass), so the
+    # number of passes is log2 of the number of kept spikes in the longest run, even for a long chain of violations
+    num_spikes = times_sorted.size
+    # comparisons are written t1 > t0 + refractory_period everywhere so both versions agree exactly with float times
+    run_starts = times_sorted[1:] > times_sorted[:-1] + refractory_period
+    if np.all(run_starts):
+        return times_sorted
+
+    # next_kept[i] is i + 1 when spike i is not followed by a violation, only the others are searched
+    # the index num_spikes is a sentinel that points to itself
+    next_kept = np.arange(1, num_spikes + 2)
+    next_kept[num_spikes] = num_spikes
+    (inds,) = np.nonzero(~run_starts)
+    next_kept[inds] = np.searchsorted(times_sorted, times_sorted[inds] + refractory_period, side="right")
+
+    keep = np.zeros(num_spikes + 1, dtype="bool")
+    keep[0] = True
+    keep[1:num_spikes] = run_starts
+    kept_inds = np.flatnonzero(keep)
     while True:
-        diffs = np.diff(times)
-        (inds,) = np.nonzero(diffs <= refractory_period)
-        if inds.size == 0:
+        new_inds = next_kept[kept_inds]
+        if np.all(keep[new_inds]):
             break
-        keep = np.ones(times.size, dtype="bool")
-        keep[inds + 1] = False
-        times = times[keep]
+        keep[new_inds] = True
+        kept_inds = np.flatnonzero(keep)
+        next_kept = next_kept[next_kept]
 
-    return times
+    return times_sorted[keep[:num_spikes]]
+
+
+def _clean_refractory_period_loop(times_sorted, refractory_period, out):
+    # times_sorted must be sorted and not empty
+    # the number of kept spikes is returned and the kept spikes are written in the first slots of out
+    last_kept = times_sorted[0]
+    out[0] = last_kept
+    num_kept = 1
+    for i in range(1, times_sorted.size):
+        if times_sorted[i] > last_kept + refractory_period:
+            last_kept = times_sorted[i]
+            out[num_kept] = last_kept
+            num_kept += 1
+    return num_kept
+
+
+def get_optimized_clean_refractory_period():
+    """
+    Return the numba compiled loop used by clean_refractory_period() or None if numba is not installed.
+    The import of numba is done only on demand because it is too heavy for the core module.
+    """
+    if hasattr(get_optimized_clean_refractory_period, "_cached_function"):
+        return get_optimized_clean_refractory_period._cached_function
+
+    try:
+        import numba
+
+        func = numba.jit(_clean_refractory_period_loop, nopython=True, nogil=True, cache=True)
+    except ImportError:
+        func = None
+
+    # Cache the compiled function
+    get_optimized_clean_refractory_period._cached_function = func
+
+    return func
 
 
 def inject_some_duplicate_units(sorting, num=4, max_shift=5, ratio=None, seed=None):
@@ -802,10 +873,16 @@ def exp_growth(start_amp, end_amp, duration_ms, tau_ms, sampling_frequency, flip
     if flip:
         start_amp, end_amp = end_amp, start_amp
     size = int(duration_ms * sampling_frequency / 1000.0)
-    times_ms = np.arange(size + 1) / sampling_frequency * 1000.0
-    y = np.exp(times_ms / tau_ms)
-    y = y / (y[-1] - y[0]) * (end_amp - start_amp)
-    y = y - y[0] + start_amp
+    # all operations are done inplace in one buffer
+    y = np.arange(size + 1, dtype="float64")
+    y /= sampling_frequency
+    y *= 1000.0
+    y /= tau_ms
+    np.exp(y, out=y)
+    y /= y[-1] - y[0]
+    y *= end_amp - start_amp
+    y -= y[0]
+    y += start_amp
     if flip:
         y = y[::-1]
     return y[:-1]
@@ -1145,6 +1222,11 @@ class InjectTemplatesRecording(BaseRecording):
             assert upsample_vector is not None
             assert upsample_vector.shape == self.spike_vector.shape
 
+        # (num_units, num_upsample, num_samples, num_channels) C-order copy of the templates shared by all segments
+        # the strided upsampled views templates[unit, :, :, upsample] would be slow to read
+        templates_4d = templates if templates.ndim == 4 else templates[:, :, :, np.newaxis]
+        templates_contiguous = np.ascontiguousarray(templates_4d.transpose(0, 3, 1, 2))
+
         if amplitude_factor is None:
             amplitude_vector = None
         elif np.isscalar(amplitude_factor):
@@ -1187,6 +1269,7 @@ class InjectTemplatesRecording(BaseRecording):
                 self.dtype,
                 spikes,
                 templates,
+                templates_contiguous,
                 nbefore,
                 amplitude_vec,
                 upsample_vec,
@@ -1226,6 +1309,7 @@ class InjectTemplatesRecordingSegment(BaseRecordingSegment):
         dtype,
         spike_vector: np.ndarray,
         templates: np.ndarray,
+        templates_contiguous: np.ndarray,
         nbefore: int,
         amplitude_vector: Union[List[float], None],
         upsample_vector: Union[List[float], None],
@@ -1242,6 +1326,7 @@ class InjectTemplatesRecordingSegment(BaseRecordingSegment):
         self.dtype = dtype
         self.spike_vector = spike_vector
         self.templates = templates
+        self.templates_contiguous = templates_contiguous
         self.nbefore = nbefore
         self.amplitude_vector = amplitude_vector
         self.upsample_vector = upsample_vector
@@ -1275,43 +1360,150 @@ class InjectTemplatesRecordingSegment(BaseRecordingSegment):
         start = np.searchsorted(self.spike_vector["sample_index"], start_frame - self.templates.shape[1], side="left")
         end = np.searchsorted(self.spike_vector["sample_index"], end_frame + self.templates.shape[1], side="right")
 
-        for i in range(start, end):
-            spike = self.spike_vector[i]
-            t = spike["sample_index"]
-            unit_ind = spike["unit_index"]
+        # same rule as the numpy inplace add, so both engines fail the same way (for instance int parent traces)
+        wf_dtype = self.templates.dtype
+        if self.amplitude_vector is not None:
+            wf_dtype = np.result_type(wf_dtype, np.asarray(self.amplitude_vector).dtype)
+        if not np.can_cast(wf_dtype, traces.dtype, casting="same_kind"):
+            raise TypeError(f"Templates of dtype {wf_dtype} can not be injected into traces of dtype {traces.dtype}")
+
+        inject_func = get_optimized_inject_templates()
+        if inject_func is not None:
+            # channels are selected inside the kernel to avoid a copy of all templates at each call
+            channel_inds = np.arange(self.templates.shape[2], dtype="int64")
+            if channel_indices is not None:
+                channel_inds = channel_inds[channel_indices]
             if self.upsample_vector is None:
-                template = self.templates[unit_ind]
+                upsample_indices = np.zeros(end - start, dtype="int64")
             else:
-                upsample_ind = self.upsample_vector[i]
-                template = self.templates[unit_ind, :, :, upsample_ind]
+                upsample_indices = np.asarray(self.upsample_vector[start:end], dtype="int64")
+            if self.amplitude_vector is None:
+                amplitudes = np.ones(end - start, dtype="float32")
+            else:
+                amplitudes = np.asarray(self.amplitude_vector[start:end], dtype="float32")
+            inject_func(
+                traces,
+                self.spike_vector["sample_index"][start:end].astype("int64"),
+                self.spike_vector["unit_index"][start:end].astype("int64"),
+                upsample_indices,
+                amplitudes,
+                self.templates_contiguous,
+                channel_inds,
+                int(self.nbefore),
+                int(start_frame),
+            )
+        else:
+            self._inject_templates_numpy(traces, start, end, start_frame, end_frame, channel_indices)
+
+        return traces.astype(self.dtype)
+
+    def _inject_templates_numpy(self, traces, start, end, start_frame, end_frame, channel_indices):
+        num_frames = end_frame - start_frame
+        width = self.templates.shape[1]
+
+        # boundaries in traces and in template of all spikes computed at once
+        starts_traces = self.spike_vector["sample_index"][start:end].astype("int64") - self.nbefore - start_frame
+        ends_traces = starts_traces + width
+        (valid,) = np.nonzero((starts_traces < num_frames) & (ends_traces > 0))
+        starts_template = np.maximum(-starts_traces, 0)
+        ends_template = width - np.maximum(ends_traces - num_frames, 0)
+        starts_traces = np.maximum(starts_traces, 0)
+        ends_traces = np.minimum(ends_traces, num_frames)
+
+        # group spikes by (unit, upsample) so that each template is sliced only once per call
+        num_upsample = 1 if self.upsample_vector is None else self.templates.shape[3]
+        group_keys = self.spike_vector["unit_index"][start:end].astype("int64") * num_upsample
+        if self.upsample_vector is not None:
+            group_keys += self.upsample_vector[start:end]
+        order = valid[np.argsort(group_keys[valid], kind="stable")]
+        keys, group_starts = np.unique(group_keys[order], return_index=True)
+        group_bounds = list(group_starts) + [order.size]
+
+        for g, key in enumerate(keys):
+            unit_ind, upsample_ind = divmod(int(key), num_upsample)
+            # contiguous (num_samples, num_channels) so the add reads sequential memory
+            template = self.templates_contiguous[unit_ind, upsample_ind]
 
             if channel_indices is not None:
                 template = template[:, channel_indices]
 
-            start_traces = t - self.nbefore - start_frame
-            end_traces = start_traces + template.shape[0]
-            if start_traces >= end_frame - start_frame or end_traces <= 0:
-                continue
+            inds = order[group_bounds[g] : group_bounds[g + 1]]
+            # plain python int are much faster than numpy scalar in this loop
+            for i, start_traces, end_traces, start_template, end_template in zip(
+                (inds + start).tolist(),
+                starts_traces[inds].tolist(),
+                ends_traces[inds].tolist(),
+                starts_template[inds].tolist(),
+                ends_template[inds].tolist(),
+            ):
+                wf = template[start_template:end_template]
+                if self.amplitude_vector is not None:
+                    # not inplace to not modify the templates
+                    wf = wf * self.amplitude_vector[i]
+                traces[start_traces:end_traces] += wf
 
-            start_template = 0
-            end_template = template.shape[0]
+    def get_num_samples(self) -> int:
+        return self.num_samples
 
-            if start_traces < 0:
-                start_template = -start_traces
-                start_traces = 0
-            if end_traces > end_frame - start_frame:
-                end_template = template.shape[0] + end_frame - start_frame - end_traces
-                end_traces = end_frame - start_frame
 
-            wf = template[start_template:end_template]
-            if self.amplitude_vector is not None:
-                wf *= self.amplitude_vector[i]
-            traces[start_traces:end_traces] += wf
+def get_optimized_inject_templates():
+    """
+    Return the numba kernel used by InjectTemplatesRecordingSegment.get_traces() or None if numba is not installed.
+    The import of numba is done only on demand because it is too heavy for the core module.
+    """
+    if hasattr(get_optimized_inject_templates, "_cached_function"):
+        return get_optimized_inject_templates._cached_function
+
+    try:
+        import numba
+    except ImportError:
+        get_optimized_inject_templates._cached_function = None
+        return None
+
+    @numba.jit(nopython=True, nogil=True, cache=True)
+    def inject_templates_loop(
+        traces,
+        sample_indices,
+        unit_indices,
+        upsample_indices,
+        amplitudes,
+        templates,
+        channel_indices,
+        nbefore,
+        start_frame,
+    ):
+        """
+        Add templates into traces inplace.
+
+        The loop is not threaded with prange: get_traces() is called inside the workers of
+        ChunkRecordingExecutor and the parallelism is given by n_jobs.
+        """
+        num_samples, num_channels = traces.shape
+        width = templates.shape[2]
+        # channel_indices[c] is the template channel of the channel c of traces
+        all_channels = num_channels == templates.shape[3] and np.all(channel_indices == np.arange(num_channels))
+        for i in range(sample_indices.size):
+            spike_start = sample_indices[i] - nbefore - start_frame
+            t0 = max(spike_start, 0)
+            t1 = min(spike_start + width, num_samples)
+            unit_ind = unit_indices[i]
+            upsample_ind = upsample_indices[i]
+            amplitude = amplitudes[i]
+            if all_channels:
+                for t in range(t0, t1):
+                    for c in range(num_channels):
+                        traces[t, c] += amplitude * templates[unit_ind, upsample_ind, t - spike_start, c]
+            else:
+                for t in range(t0, t1):
+                    for c in range(num_channels):
+                        traces[t, c] += (
+                            amplitude * templates[unit_ind, upsample_ind, t - spike_start, channel_indices[c]]
+                        )
 
-        return traces.astype(self.dtype)
+    # Cache the compiled function
+    get_optimized_inject_templates._cached_function = inject_templates_loop
 
-    def get_num_samples(self) -> int:
-        return self.num_samples
+    return inject_templates_loop
 
 
 inject_templates = define_function_from_class(source_class=InjectTemplatesRecording, name="inject_templates")
@@ -1326,13 +1518,9 @@ def generate_channel_locations(num_channels, num_columns, contact_spacing_um):
     else:
         assert num_channels % num_columns == 0, "Invalid num_columns"
         num_contact_per_column = num_channels // num_columns
-        j = 0
-        for i in range(num_columns):
-            channel_locations[j : j + num_contact_per_column, 0] = i * contact_spacing_um
-            channel_locations[j : j + num_contact_per_column, 1] = (
-                np.arange(num_contact_per_column) * contact_spacing_um
-            )
-            j += num_contact_per_column
+        # contacts are ordered column by column
+        channel_locations[:, 0] = np.repeat(np.arange(num_columns) * contact_spacing_um, num_contact_per_column)
+        channel_locations[:, 1] = np.tile(np.arange(num_contact_per_column) * contact_spacing_um, num_columns)
     return channel_locations
 
 
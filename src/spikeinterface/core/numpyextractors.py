@@ -192,12 +192,21 @@ class NumpySorting(BaseSorting):
         if unit_ids is None:
             unit_ids = np.unique(np.concatenate([np.unique(labels_list[i]) for i in range(nseg)]))
 
+        # labels are mapped to unit index with a binary search in the sorted unit_ids instead of one mask per unit
+        unit_ids_array = np.asarray(unit_ids)
+        unit_ids_order = np.argsort(unit_ids_array, kind="stable")
+        sorted_unit_ids = unit_ids_array[unit_ids_order]
+
         spikes = []
         for i in range(nseg):
             times, labels = times_list[i], labels_list[i]
             unit_index = np.zeros(labels.size, dtype="int64")
-            for u, unit_id in enumerate(unit_ids):
-                unit_index[labels == unit_id] = u
+            if sorted_unit_ids.size > 0:
+                pos = np.searchsorted(sorted_unit_ids, labels, side="right") - 1
+                pos = np.clip(pos, 0, sorted_unit_ids.size - 1)
+                # labels not in unit_ids keep unit_index 0
+                found = sorted_unit_ids[pos] == labels
+                unit_index[found] = unit_ids_order[pos[found]]
             spikes_in_seg = np.zeros(len(times), dtype=minimum_spike_dtype)
             spikes_in_seg["sample_index"] = times
             spikes_in_seg["unit_index"] = unit_index
@@ -1,20 +1,26 @@
 import pytest
 import psutil
+import time
 
 import numpy as np
 
-from spikeinterface.core import load_extractor, extract_waveforms
+from spikeinterface.core import load_extractor, extract_waveforms, NumpyRecording
 from spikeinterface.core.generate import (
     generate_recording,
     generate_sorting,
     NoiseGeneratorRecording,
     generate_recording_by_size,
     InjectTemplatesRecording,
+    get_optimized_inject_templates,
     generate_single_fake_waveform,
     generate_templates,
     generate_channel_locations,
     generate_unit_locations,
     generate_ground_truth_recording,
+    clean_refractory_period,
+    _clean_refractory_period_numpy,
+    _clean_refractory_period_loop,
+    synthesize_random_firings,
 )
 
 
@@ -35,6 +41,27 @@ def test_generate_sorting():
     pass
 
 
+def test_synthesize_random_firings():
+    sampling_frequency = 30000.0
+    duration = 10.0
+    refractory_period_ms = 4.0
+    refractory_sample = int(refractory_period_ms / 1000.0 * sampling_frequency)
+    for add_shift_shuffle in (False, True):
+        times, labels = synthesize_random_firings(
+            num_units=5,
+            sampling_frequency=sampling_frequency,
+            duration=duration,
+            refractory_period_ms=refractory_period_ms,
+            firing_rates=10.0,
+            add_shift_shuffle=add_shift_shuffle,
+            seed=2205,
+        )
+        assert np.all(np.diff(times) >= 0)
+        assert np.all((times >= 0) & (times < int(sampling_frequency * duration)))
+        for unit_ind in range(5):
+            assert np.all(np.diff(times[labels == unit_ind]) > refractory_sample)
+
+
 def test_generate_sorting_with_spikes_on_borders():
     num_spikes_on_borders = 10
     border_size_samples = 10
@@ -64,6 +91,45 @@ def test_generate_sorting_with_spikes_on_borders():
             )
 
 
+def test_clean_refractory_period():
+    times = np.array([40, 10, 13, 16, 30, 31], dtype="int64")
+    clean_times = clean_refractory_period(times, 4)
+    np.testing.assert_array_equal(clean_times, [10, 16, 30, 40])
+    assert np.all(np.diff(clean_times) > 4)
+
+    rng = np.random.default_rng(seed=2205)
+    times = rng.integers(0, 100_000, size=5_000)
+    clean_times = clean_refractory_period(times, 30)
+    assert np.all(np.diff(clean_times) > 30)
+    assert np.all(np.isin(clean_times, times))
+
+    assert clean_refractory_period(np.array([], dtype="int64"), 4).size == 0
+
+    # the numpy fallback and the pure python loop (used by numba) give the same greedy result
+    times = np.sort(times)
+    out = np.empty_like(times)
+    num_kept = _clean_refractory_period_loop(times, 30, out)
+    np.testing.assert_array_equal(out[:num_kept], clean_times)
+    np.testing.assert_array_equal(_clean_refractory_period_numpy(times, 30), clean_times)
+
+    # same with float times in seconds
+    times_s = times / 30000.0
+    out = np.empty_like(times_s)
+    num_kept = _clean_refractory_period_loop(times_s, 0.001, out)
+    np.testing.assert_array_equal(_clean_refractory_period_numpy(times_s, 0.001), out[:num_kept])
+
+    # chain of spikes: the greedy approach keeps one spike out of two
+    times = np.arange(0, 100, 3)
+    np.testing.assert_array_equal(_clean_refractory_period_numpy(times, 4), np.arange(0, 100, 6))
+
+    # a long chain must not need one pass per removed spike (this took minutes with an O(n^2) approach)
+    times = np.arange(0, 600_000, 3)
+    t0 = time.perf_counter()
+    clean_times = _clean_refractory_period_numpy(times, 4)
+    assert time.perf_counter() - t0 < 1.0
+    np.testing.assert_array_equal(clean_times, np.arange(0, 600_000, 6))
+
+
 def measure_memory_allocation(measure_in_process: bool = True) -> float:
     """
     A local utility to measure memory allocation at a specific point in time.
@@ -412,11 +478,69 @@ def test_inject_templates():
         assert rec.get_traces(start_frame=100, end_frame=600, segment_index=1).shape == (500, 4)
         assert rec.get_traces(start_frame=rec_noise.get_num_frames(0) - 200, segment_index=0).shape == (200, 4)
 
+        # the contiguous copy of the templates is shared by all segments
+        seg0, seg1 = rec._recording_segments
+        assert seg0.templates_contiguous is seg1.templates_contiguous
+
         # Check dumpability
         saved_loaded = load_extractor(rec.to_dict())
         check_recordings_equal(rec, saved_loaded, return_scaled=False)
 
 
+def test_inject_templates_amplitude_factor(monkeypatch):
+    # force the numpy engine
+    monkeypatch.setattr(get_optimized_inject_templates, "_cached_function", None, raising=False)
+
+    sorting = generate_sorting(num_units=2, durations=[1.0], firing_rates=20.0, seed=2205)
+    rng = np.random.default_rng(seed=2205)
+    templates = rng.standard_normal((2, 20, 4)).astype("float32")
+    amplitude_factor = rng.uniform(0.5, 1.5, size=sorting.to_spike_vector().size).astype("float32")
+    rec = InjectTemplatesRecording(
+        sorting, templates, nbefore=10, amplitude_factor=amplitude_factor, num_samples=30_000
+    )
+    templates_before = templates.copy()
+
+    # the amplitudes must not scale the templates inplace
+    traces0 = rec.get_traces()
+    traces1 = rec.get_traces()
+    np.testing.assert_array_equal(rec.templates, templates_before)
+    np.testing.assert_array_equal(traces0, traces1)
+
+
+def test_inject_templates_engines():
+    pytest.importorskip("numba")
+
+    rec, sorting = generate_ground_truth_recording(
+        durations=[3.0], num_channels=8, num_units=6, upsample_factor=3, noise_kwargs=dict(noise_level=0.0), seed=2205
+    )
+    rec_segment = rec._recording_segments[0]
+    for start_frame, end_frame, channel_indices in [
+        (0, 90_000, None),
+        (1000, 1100, [5, 2]),
+        (500, 2000, slice(1, 7, 2)),
+        (500, 2000, [7, 6, 5, 4, 3, 2, 1, 0]),
+        (0, 3, None),
+    ]:
+        traces_numba = rec_segment.get_traces(start_frame, end_frame, channel_indices)
+
+        traces_numpy = np.zeros_like(traces_numba)
+        start = np.searchsorted(rec_segment.spike_vector["sample_index"], start_frame - rec.templates.shape[1])
+        end = np.searchsorted(rec_segment.spike_vector["sample_index"], end_frame + rec.templates.shape[1], "right")
+        rec_segment._inject_templates_numpy(traces_numpy, start, end, start_frame, end_frame, channel_indices)
+
+        np.testing.assert_allclose(traces_numba, traces_numpy, atol=1e-4)
+
+
+def test_inject_templates_integer_parent():
+    sorting = generate_sorting(num_units=2, durations=[1.0], seed=2205)
+    templates = np.full((2, 20, 4), 2.7, dtype="float32")
+    parent_recording = NumpyRecording([np.zeros((30_000, 4), dtype="int16")], sampling_frequency=30_000.0)
+    rec = InjectTemplatesRecording(sorting, templates, nbefore=10, parent_recording=parent_recording)
+    # float templates can not be added inplace into integer traces, with or without numba
+    with pytest.raises(TypeError):
+        rec.get_traces()
+
+
 def test_generate_ground_truth_recording():
     rec, sorting = generate_ground_truth_recording(upsample_factor=None)
     assert rec.templates.ndim == 3
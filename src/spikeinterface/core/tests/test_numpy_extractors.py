@@ -53,6 +53,17 @@ def test_NumpySorting():
     # print(sorting)
     assert sorting.get_num_segments() == 3
 
+    # string unit_ids in any order, a label not in unit_ids goes to unit_index 0
+    times = np.array([5, 10, 15, 20, 25])
+    labels = np.array(["b", "a", "c", "a", "z"])
+    sorting = NumpySorting.from_times_labels(times, labels, sampling_frequency, unit_ids=["c", "a", "b"])
+    assert np.array_equal(sorting.to_spike_vector()["unit_index"], [2, 1, 0, 1, 0])
+
+    # duplicated unit_ids: a label goes to its last occurrence
+    labels = np.array([1, 2, 1, 3, 2])
+    sorting = NumpySorting.from_times_labels(times, labels, sampling_frequency, unit_ids=[2, 1, 2, 3])
+    assert np.array_equal(sorting.to_spike_vector()["unit_index"], [1, 2, 1, 3, 2])
+
     # from other extracrtor
     num_seg = 2
     file_path = cache_folder / "test_NpzSortingExtractor.npz"
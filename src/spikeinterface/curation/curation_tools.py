@@ -47,12 +47,16 @@ def _find_duplicated_spikes_random(spike_train: np.ndarray, censored_period: int
     # random seed
     rng = np.random.RandomState(seed=seed)
 
+    # candidates do not depend on the iteration
+    (duplicates,) = np.where(np.diff(spike_train) <= censored_period)
+    duplicates = np.unique(np.concatenate((duplicates, duplicates + 1)))
+
     indices_of_duplicates = []
-    while not np.all(np.diff(np.delete(spike_train, indices_of_duplicates)) > censored_period):
-        (duplicates,) = np.where(np.diff(spike_train) <= censored_period)
-        duplicates = np.unique(np.concatenate((duplicates, duplicates + 1)))
+    keep = np.ones(spike_train.size, dtype="bool")
+    while not np.all(np.diff(spike_train[keep]) > censored_period):
         duplicate = rng.choice(duplicates)
         indices_of_duplicates.append(duplicate)
+        keep[duplicate] = False
 
     return np.array(indices_of_duplicates, dtype=np.int64)
 
@@ -29,6 +29,18 @@ KACHERY_CLOUD_SET = bool(os.getenv("KACHERY_CLOUD_CLIENT_ID")) and bool(os.geten
 set_global_tmp_folder(cache_folder)
 
 
+def _mearec_sorting():
+    local_path = si.download_dataset(remote_path="mearec/mearec_test_10s.h5")
+    _, sorting = read_mearec(local_path)
+    return sorting
+
+
+@pytest.fixture(scope="module")
+def mearec_sorting():
+    # downloaded and read only once for all tests of the module
+    return _mearec_sorting()
+
+
 # this needs to be run only once
 def generate_sortingview_curation_dataset():
     import spikeinterface.widgets as sw
@@ -51,12 +63,11 @@ def generate_sortingview_curation_dataset():
 
 
 @pytest.mark.skipif(ON_GITHUB and not KACHERY_CLOUD_SET, reason="Kachery cloud secrets not available")
-def test_gh_curation():
+def test_gh_curation(mearec_sorting):
     """
     Test curation using GitHub URI.
     """
-    local_path = si.download_dataset(remote_path="mearec/mearec_test_10s.h5")
-    _, sorting = read_mearec(local_path)
+    sorting = mearec_sorting
     # curated link:
     # https://figurl.org/f?v=gs://figurl/spikesortingview-10&d=sha1://bd53f6b707f8121cadc901562a89b67aec81cc81&label=SpikeInterface%20-%20Sorting%20Summary&s={%22sortingCuration%22:%22gh://alejoe91/spikeinterface/fix-codecov/spikeinterface/curation/tests/sv-sorting-curation.json%22}
     gh_uri = "gh://SpikeInterface/spikeinterface/main/src/spikeinterface/curation/tests/sv-sorting-curation.json"
@@ -79,12 +90,11 @@ def test_gh_curation():
 
 
 @pytest.mark.skipif(ON_GITHUB and not KACHERY_CLOUD_SET, reason="Kachery cloud secrets not available")
-def test_sha1_curation():
+def test_sha1_curation(mearec_sorting):
     """
     Test curation using SHA1 URI.
     """
-    local_path = si.download_dataset(remote_path="mearec/mearec_test_10s.h5")
-    _, sorting = read_mearec(local_path)
+    sorting = mearec_sorting
 
     # from SHA1
     # curated link:
@@ -109,12 +119,11 @@ def test_sha1_curation():
     assert len(sorting_curated_sha1_art_mua.unit_ids) == 5
 
 
-def test_json_curation():
+def test_json_curation(mearec_sorting):
     """
     Test curation using a JSON file.
     """
-    local_path = si.download_dataset(remote_path="mearec/mearec_test_10s.h5")
-    _, sorting = read_mearec(local_path)
+    sorting = mearec_sorting
 
     # from curation.json
     json_file = parent_folder / "sv-sorting-curation.json"
@@ -149,8 +158,9 @@ def test_false_positive_curation():
     num_timepoints = int(sampling_frequency * duration)
     num_units = 20
     num_spikes = 1000
-    times = np.int_(np.sort(np.random.uniform(0, num_timepoints, num_spikes)))
-    labels = np.random.randint(1, num_units + 1, size=num_spikes)
+    rng = np.random.default_rng(seed=0)
+    times = np.sort(rng.integers(0, num_timepoints, size=num_spikes))
+    labels = rng.integers(1, num_units + 1, size=num_spikes)
 
     sorting = se.NumpySorting.from_times_labels(times, labels, sampling_frequency)
     # print("Sorting: {}".format(sorting.get_unit_ids()))
@@ -263,9 +273,10 @@ def test_label_inheritance_str():
 
 if __name__ == "__main__":
     # generate_sortingview_curation_dataset()
-    test_sha1_curation()
-    test_gh_curation()
-    test_json_curation()
+    sorting = _mearec_sorting()
+    test_sha1_curation(sorting)
+    test_gh_curation(sorting)
+    test_json_curation(sorting)
     test_false_positive_curation()
     test_label_inheritance_int()
     test_label_inheritance_str()